@@ -67,8 +67,9 @@ def read_empad(filename, mem="RAM", binfactor=1, metadata=False, **kwargs):
         for Rx, Ry in tqdmnd(
             R_Nx, R_Ny, desc="Binning data", unit="DP", unit_scale=True
         ):
-            data[Rx, Ry, :, :] = bin2D(
-                memmap[Rx, Ry, :, :], binfactor, dtype=np.float32
+            bin2D(
+                memmap[Rx, Ry, :, :], binfactor, dtype=np.float32,
+                out=data[Rx, Ry, :, :]
             )
     else:
         # memory mapping + bin-on-load is not supported
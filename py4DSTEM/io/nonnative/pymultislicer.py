@@ -3,10 +3,23 @@
 #
 # @author: mxu86
 
+import os
+import re
+import mmap
 import numpy as np
+try:
+    import numba as nb
+except ImportError:
+    pass
 from pathlib import Path
+from tempfile import TemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
 from ..datastructure import DataCube
-from ...process.utils import bin2D, tqdmnd
+from ...process.utils import tqdmnd
+
+# the scan shape is encoded at the end of the filename, e.g. "..._x64_y32.raw"
+_SCAN_SHAPE_RE = re.compile(r"(?:^|_)[A-Za-z](\d+)_[A-Za-z](\d+)\.[^._]+$")
 
 
 def read_pymultislicer(filename, mem="RAM", binfactor=1, metadata=False, **kwargs):
@@ -18,8 +31,21 @@ def read_pymultislicer(filename, mem="RAM", binfactor=1, metadata=False, **kwarg
     By extracting the scan position of the first and last frames, the function determines the scan
     size. Then, the full dataset is loaded and cropped to the 128x128 valid region.
 
+    With binfactor > 1, the data is binned in diffraction space one scan row at a time
+    as it is read.  If mem is "MEMMAP", the binned data is written to a memory map backed
+    by a temporary file, so that peak RAM use is bounded by a single scan row.
+
     Accepts:
         filename    (str) path to the EMPAD file
+        mem         (str) "RAM" or "MEMMAP"
+        binfactor   (int) binning factor
+        raw_dtype   (dtype, optional) the element type of the file, as passed to
+                    save_pymultislicer. Default is float32.  Data from counting
+                    detectors may be stored as uint16 to halve the file size.
+        dtype       (dtype, optional) the datatype of the binned data. Ignored if
+                    binfactor is 1. Default is float32.
+        transpose   (bool, optional) set to True for files written with
+                    save_pymultislicer(..., transpose=True). Default is False.
 
     Returns:
         data        (DataCube) the 4D datacube, excluding the metadata rows.
@@ -34,57 +60,168 @@ def read_pymultislicer(filename, mem="RAM", binfactor=1, metadata=False, **kwarg
     k2 = 128
     fPath = Path(filename)
 
-    fnm_parts = filename.split('_')
-    print(fnm_parts)
     # Get the scan shape
-    shape0 = fnm_parts[-1][1:-4]
-    print(shape0)
-    shape1 = fnm_parts[-2][1:]
-    rShape = 1 + int(shape1[0:2]) - int(shape0[0:2]) # scan shape
-    data_shape = (int(shape0), int(shape1), k1, k2)
+    match = _SCAN_SHAPE_RE.search(fPath.name)
+    assert match is not None, "Error: filename must end with the scan shape, e.g. '_x64_y32.raw'"
+    shape1, shape0 = int(match.group(1)), int(match.group(2))
+    data_shape = (shape0, shape1, k1, k2)
+    raw_dtype = np.dtype(kwargs.get("raw_dtype", np.float32)).newbyteorder("<")
 
     # Load the data
-    if (mem, binfactor) == ("RAM", 1):
+    if kwargs.get("transpose", False):
+        # diffraction-major files have no metadata rows.  The data is returned as a
+        # transposed view, so that the image at each diffraction pixel stays contiguous
+        assert binfactor == 1, "Error: on-load binning is not supported for transposed files"
+        t_shape = (k2, k2, shape0, shape1)
+        if mem == "RAM":
+            data = np.fromfile(fPath, raw_dtype, count=np.prod(t_shape)).reshape(t_shape)
+        else:
+            data = np.memmap(fPath, dtype=raw_dtype, mode="r", shape=t_shape)
+        data = data.transpose(2, 3, 0, 1)
+
+    elif (mem, binfactor) == ("RAM", 1):
+        # read one scan row at a time into a single reusable buffer, and copy only the
+        # valid 128x128 regions into a C-contiguous array
+        data = np.empty((data_shape[0], data_shape[1], k2, k2), dtype=raw_dtype)
+        row = np.empty((data_shape[1], k1, k2), dtype=raw_dtype)
         with open(fPath, "rb") as fid:
-            data = np.fromfile(fid, np.float32).reshape(data_shape)[:, :, :128, :]
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fid.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for Rx in range(data_shape[0]):
+                nbytes = fid.readinto(row)
+                assert nbytes == row.nbytes, "Error: file is smaller than its scan shape"
+                data[Rx] = row[:, :k2, :]
 
     elif (mem, binfactor) == ("MEMMAP", 1):
-        data = np.memmap(fPath, dtype=np.float32, mode="r", shape=data_shape)[
-               :, :, :128, :
-               ]
-
-    elif (mem) == ("RAM"):
-        # binned read into RAM
-        memmap = np.memmap(fPath, dtype=np.float32, mode="r", shape=data_shape)[
-                 :, :, :128, :
-                 ]
-        Q_Nx, Q_Ny, R_Nx, R_Ny = memmap.shape
-        Q_Nx, Q_Ny = Q_Nx // binfactor, Q_Ny // binfactor
-        data = np.zeros((Q_Nx, Q_Ny, R_Nx, R_Ny), dtype=np.float32)
-        for Rx, Ry in tqdmnd(
-                R_Nx, R_Ny, desc="Binning data", unit="DP", unit_scale=True
-        ):
-            data[:, :, Rx, Ry] = bin2D(
-                memmap[:, :, Rx, Ry], binfactor, dtype=np.float32
-            )
+        # no access pattern hint here: the map is handed back to the caller, who may
+        # well read it repeatedly or out of order
+        data = np.memmap(fPath, dtype=raw_dtype, mode="r", shape=data_shape)[
+            :, :, :128, :
+        ]
 
     else:
-        # memory mapping + bin-on-load is not supported
-        raise Exception(
-            "Memory mapping and on-load binning together is not supported.  Either set binfactor=1 or mem='RAM'."
-        )
-        return
+        # binned read, into RAM or into a memory map backed by a temporary file.  The
+        # file is read once, front to back, so the OS can read ahead and drop pages
+        memmap = np.memmap(fPath, dtype=raw_dtype, mode="r", shape=data_shape)
+        _advise_sequential(memmap)
+        memmap = memmap[:, :, :128, :]
+        R_Nx, R_Ny, Q_Nx, Q_Ny = memmap.shape
+        Q_Nx, Q_Ny = Q_Nx // binfactor, Q_Ny // binfactor
+        # walk the file in order, one scan row at a time, so each read is contiguous
+        # on disk.  Trailing diffraction rows/columns which don't fill a whole bin are
+        # dropped, as in bin2D
+        dtype = kwargs.get("dtype", np.float32)
+        if mem == "RAM":
+            data = np.empty((R_Nx, R_Ny, Q_Nx, Q_Ny), dtype=dtype)
+        else:
+            data = np.memmap(
+                TemporaryFile(), dtype=dtype, mode="w+",
+                shape=(R_Nx, R_Ny, Q_Nx, Q_Ny)
+            )
+        _bin_slabs(memmap, binfactor, data)
 
-    # data = np.swapaxes(data, 0, 1)
-    # data = np.swapaxes(data, 2, 3)
+    # DataCube stores data as passed, so memory maps are wrapped without being loaded
     return DataCube(data=data)
 
 
-def save_pymultislicer(cube, filename):
-    deadrows = np.zeros((2, 128)).astype(np.float32)
-    with open(filename, 'wb') as f:
+def _advise_sequential(memmap):
+    """
+    Hints to the OS that memmap will be read once, front-to-back, so that it reads ahead
+    more aggressively and frees pages soon after they are read.  Only for maps which
+    are not handed back to the caller.  A no-op on platforms without madvise.
+    """
+    if hasattr(mmap, "MADV_SEQUENTIAL") and memmap._mmap is not None:
+        memmap._mmap.madvise(mmap.MADV_SEQUENTIAL)
 
+
+def save_pymultislicer(cube, filename, raw_dtype=np.float32, transpose=False):
+    """
+    Writes the DataCube cube to filename in the pymultislicer raw format, i.e. as a
+    sequence of 130x128 frames, each a 128x128 diffraction pattern followed by two
+    zeroed metadata rows.
+
+    Frames are assembled one scan row at a time in a reusable buffer and written with
+    a single call per row, rather than with two writes per diffraction pattern.
+
+    Accepts:
+        cube        (DataCube) the data to write; diffraction patterns must be 128x128
+        filename    (str) path to the output file
+        raw_dtype   (dtype, optional) the element type to store. Default is float32.
+                    An integer type such as uint16 halves the file size, but values are
+                    cast without rescaling, so it should only be used for data which is
+                    already integer-valued, e.g. from a counting detector. The same
+                    raw_dtype must be passed to read_pymultislicer.
+        transpose   (bool, optional) if True, writes the data diffraction-major, i.e. with
+                    shape (Q_Nx,Q_Ny,R_Nx,R_Ny) and no metadata rows, so that the real
+                    space image at a single diffraction pixel is contiguous on disk. This
+                    makes e.g. virtual imaging from a memory map much faster. Such files
+                    must be read with read_pymultislicer(..., transpose=True).
+    """
+    assert (cube.Q_Nx, cube.Q_Ny) == (128, 128), "Error: pymultislicer diffraction patterns must be 128x128"
+    raw_dtype = np.dtype(raw_dtype).newbyteorder("<")
+    if transpose:
+        slab = np.empty((cube.Q_Ny, cube.R_Nx, cube.R_Ny), dtype=raw_dtype)
+        with open(filename, 'wb') as f:
+            for qx in range(cube.Q_Nx):
+                slab[:] = cube.data[:, :, qx, :].transpose(2, 0, 1)
+                slab.tofile(f)
+        return
+
+    # the two trailing metadata rows of each frame are left zeroed
+    row = np.zeros((cube.R_Ny, 130, 128), dtype=raw_dtype)
+    with open(filename, 'wb') as f:
         for px_x in range(cube.R_Nx):
-            for px_y in range(cube.R_Ny):
-                f.write(bytearray(cube.data[px_x, px_y, :, :]))
-                f.write(bytearray(deadrows))
\ No newline at end of file
+            row[:, :128, :] = cube.data[px_x]
+            row.tofile(f)
+
+
+# Binning of the file in diffraction space one scan row at a time, with and without numba
+# acceleration.  memmap is the cropped (R_Nx, R_Ny, 128, 128) file, and out is the
+# (R_Nx, R_Ny, 128//binfactor, 128//binfactor) array to fill with the sums over each
+# binfactor x binfactor block.  Each slab is a single (R_Ny, 128, 128) scan row.
+import sys
+if 'numba' in sys.modules:
+
+    @nb.njit(parallel=True, cache=True)
+    def _bin_slab(slab, binfactor, out):
+        R_Ny, Q_Nx, Q_Ny = out.shape
+        for ry in nb.prange(R_Ny):
+            for i in range(Q_Nx):
+                for j in range(Q_Ny):
+                    acc = out.dtype.type(0)
+                    for ii in range(binfactor):
+                        for jj in range(binfactor):
+                            acc += slab[ry, i * binfactor + ii, j * binfactor + jj]
+                    out[ry, i, j] = acc
+
+    def _bin_slabs(memmap, binfactor, out):
+        # the kernel is already parallel, so slabs are processed in order
+        for Rx in tqdmnd(out.shape[0], desc="Binning data", unit="row"):
+            _bin_slab(np.asarray(memmap[Rx]), binfactor, out[Rx])
+
+else:
+
+    def _bin_slab(slab, binfactor, out):
+        # reduceat reads the cropped, non-contiguous slab in place, where a reshape
+        # would first have to copy it
+        Nx, Ny = out.shape[1] * binfactor, out.shape[2] * binfactor
+        np.add.reduceat(
+            np.add.reduceat(
+                slab[:, :Nx, :Ny], np.arange(0, Nx, binfactor), axis=1,
+                dtype=out.dtype
+            ),
+            np.arange(0, Ny, binfactor), axis=2, out=out
+        )
+
+    def _bin_slabs(memmap, binfactor, out):
+        # NumPy releases the GIL while copying and summing, so slabs are binned on a
+        # pool of threads, which also keeps several page-ins in flight at once
+        def _bin_row(Rx):
+            _bin_slab(np.asarray(memmap[Rx]), binfactor, out[Rx])
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for _ in tqdm(
+                executor.map(_bin_row, range(out.shape[0])),
+                total=out.shape[0], desc="Binning data", unit="row"
+            ):
+                pass
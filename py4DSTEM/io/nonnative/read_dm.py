@@ -81,8 +81,9 @@ def read_dm(fp, mem="RAM", binfactor=1, metadata=False, **kwargs):
             data = np.empty((R_Nx, R_Ny, Q_Nx, Q_Ny), dtype=dtype)
             for Rx in range(R_Nx):
                 for Ry in range(R_Ny):
-                    data[Rx, Ry, :, :] = bin2D(
-                        memmap[Rx, Ry, :, :,], binfactor, dtype=dtype
+                    bin2D(
+                        memmap[Rx, Ry, :, :,], binfactor, dtype=dtype,
+                        out=data[Rx, Ry, :, :]
                     )
             dc = DataCube(data=data)
     else:
@@ -31,7 +31,8 @@ def read(fp, mem="RAM", binfactor=1, ft=None, metadata=False, **kwargs):
             sufficient. Binning by N reduces the filesize by N^2, so for instance, on a
             system with only 16 GB of RAM, its possible to load datasets of up to 64,
             144, or 256 GB using binfactors of 2, 3, or 4. Default is 1.
-              * Note 1: binning is only supported with mem='RAM'.
+              * Note 1: binning is only supported with mem='RAM', except for
+                pymultislicer files, which may also be binned into a memory map.
               * Note 2: binning may cause 'wraparound' errors (e.g. if the datatype is
                 uint16 and the summed pixels in a bin exceed 65536, the count 'wraps back
                 around' to 0). This can be avoided by explicitly casting the datatype by
@@ -78,7 +79,7 @@ def read(fp, mem="RAM", binfactor=1, ft=None, metadata=False, **kwargs):
     assert(binfactor>=1), "Error: binfactor must be >= 1"
     if binfactor > 1:
         assert (
-            mem != "MEMMAP"
+            mem != "MEMMAP" or ft == "pymultislicer"
         ), "Error: binning is not supported for memory mapping.  Either set binfactor=1 or set mem='RAM'"
     assert ft in [
         None,
@@ -1,8 +1,19 @@
 # Find the origin of diffraction space
 
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+from scipy.fft import rfft2, irfft2
 from scipy.ndimage.filters import gaussian_filter
-from scipy.optimize import leastsq
+from scipy.optimize import brentq, leastsq
+from scipy.signal import lfilter, lfilter_zi
+try:
+    import numba as nb
+except ImportError:
+    pass
+from tqdm import tqdm
 
 from ..fit import plane,parabola,bezier_two,fit_2D
 from ..utils import get_CoM, add_to_2D_array_from_floats, tqdmnd, get_maxima_2D
@@ -13,6 +24,10 @@ from ..diskdetection.diskdetection import _find_Bragg_disks_single_DP_FK
 
 ### Functions for finding the origin
 
+# size in bytes of the tiles of diffraction patterns processed together by get_origin,
+# chosen to fit comfortably in a typical L2/L3 cache
+_TILE_BYTES = 8 * 2 ** 20
+
 
 def get_probe_size(DP, thresh_lower=0.01, thresh_upper=0.99, N=100):
     """
@@ -45,14 +60,12 @@ def get_probe_size(DP, thresh_lower=0.01, thresh_upper=0.99, N=100):
             * **y0**: *(float)* the y position of the central disk center
     """
     thresh_vals = np.linspace(thresh_lower, thresh_upper, N)
-    r_vals = np.zeros(N)
 
-    # Get r for each mask
-    DPmax = np.max(DP)
-    for i in range(len(thresh_vals)):
-        thresh = thresh_vals[i]
-        mask = DP > DPmax * thresh
-        r_vals[i] = np.sqrt(np.sum(mask) / np.pi)
+    # Get r for each mask, counting the pixels above each threshold in the sorted DP
+    DPsorted = np.sort(DP, axis=None)
+    DPmax = DPsorted[-1]
+    counts = DPsorted.size - np.searchsorted(DPsorted, DPmax * thresh_vals, side="right")
+    r_vals = np.sqrt(counts / np.pi)
 
     # Get derivative and determine trustworthy r-values
     dr_dtheta = np.gradient(r_vals)
@@ -67,7 +80,64 @@ def get_probe_size(DP, thresh_lower=0.01, thresh_upper=0.99, N=100):
     return r, x0, y0
 
 
-def get_origin_single_dp(dp, r, rscale=1.2):
+def _gauss_iir_2d(im, sigma):
+    """
+    Gaussian blurs the last two axes of `im` with the 4th order recursive (IIR) filter of
+    van Vliet, Young and Verbeek, run forwards then backwards along each axis. The cost
+    per pixel is independent of sigma, unlike gaussian_filter. Away from the edges, where
+    the data is extended with its edge values, the impulse response has standard
+    deviation sigma, and differs from a gaussian by at most 1% of its peak for
+    sigma >= 2, and 4% for smaller sigma. Falls back to gaussian_filter for sigma < 1,
+    where the recursive approximation degrades and a direct filter is cheap anyway.
+
+    Args:
+        im (ndarray): the image, or a stack of images along the leading axes
+        sigma (number): the standard deviation of the gaussian, in pixels
+
+    Returns:
+        (ndarray): the blurred image(s), in single precision for single precision
+        input and in double precision otherwise
+    """
+    if sigma < 1:
+        return gaussian_filter(im, (0,) * (np.ndim(im) - 2) + (sigma, sigma))
+    dtype = np.float32 if np.asarray(im).dtype == np.float32 else np.float64
+    b, a, zi = (c.astype(dtype) for c in _gauss_iir_coefficients(float(sigma)))
+    out = np.asarray(im, dtype=dtype)
+    for axis in (-2, -1):
+        out = np.moveaxis(out, axis, -1)
+        for _ in range(2):
+            out, _ = lfilter(b, a, out, axis=-1, zi=zi * out[..., :1])
+            out = out[..., ::-1]
+        out = np.moveaxis(out, -1, axis)
+    return out
+
+
+# Poles of the 4th order recursive gaussian of van Vliet, Young and Verbeek (1998) for
+# sigma = 2. Other widths scale the poles to d**(1/q).
+_GAUSS_IIR_POLES = np.array(
+    [1.13228 + 1.28114j, 1.13228 - 1.28114j, 1.78534 + 0.46763j, 1.78534 - 0.46763j]
+)
+
+
+@lru_cache(maxsize=16)
+def _gauss_iir_coefficients(sigma):
+    """
+    Returns the lfilter coefficients (b,a) of the van Vliet-Young-Verbeek recursive
+    gaussian, and the initial filter state zi for a unit step. The pole scaling q is
+    solved for so that the variance of the forward-backward impulse response is exactly
+    sigma**2.
+    """
+    def variance(q):
+        d = _GAUSS_IIR_POLES ** (1 / q)
+        return np.sum(2 * d / (d - 1) ** 2).real
+
+    q = brentq(lambda q: variance(q) - sigma ** 2, 0.1, sigma + 10)
+    a = np.poly(1 / _GAUSS_IIR_POLES ** (1 / q)).real
+    b = np.array([a.sum()])
+    return b, a, lfilter_zi(b, a)
+
+
+def get_origin_single_dp(dp, r, rscale=1.2, working_dtype=np.float32):
     """
     Find the origin for a single diffraction pattern, assuming (a) there is no beam stop,
     and (b) the center beam contains the highest intensity.
@@ -76,19 +146,29 @@ def get_origin_single_dp(dp, r, rscale=1.2):
         dp (ndarray): the diffraction pattern
         r (number): the approximate disk radius
         rscale (number): factor by which `r` is scaled to generate a mask
+        working_dtype (dtype): the floating point type dp is cast to for the
+            calculation. Use np.float64 for full double precision
 
     Returns:
         (2-tuple): The origin
     """
+    dp = np.asarray(dp, dtype=working_dtype)
     Q_Nx, Q_Ny = dp.shape
-    _qx0, _qy0 = np.unravel_index(np.argmax(gaussian_filter(dp, r)), (Q_Nx, Q_Ny))
-    qyy, qxx = np.meshgrid(np.arange(Q_Ny), np.arange(Q_Nx))
-    mask = np.hypot(qxx - _qx0, qyy - _qy0) < r * rscale
-    qx0, qy0 = get_CoM(dp * mask)
+    _qx0, _qy0 = np.unravel_index(np.argmax(_gauss_iir_2d(dp, r)), (Q_Nx, Q_Ny))
+    qx0, qy0 = _masked_com(dp, _qx0, _qy0, (r * rscale) ** 2)
     return qx0, qy0
 
 
-def get_origin(datacube, r=None, rscale=1.2, dp_max=None, mask=None):
+def get_origin(
+    datacube,
+    r=None,
+    rscale=1.2,
+    dp_max=None,
+    mask=None,
+    max_workers=1,
+    CUDA=False,
+    working_dtype=np.float32,
+):
     """
     Find the origin for all diffraction patterns in a datacube, assuming (a) there is no
     beam stop, and (b) the center beam contains the highest intensity
@@ -111,6 +191,19 @@ def get_origin(datacube, r=None, rscale=1.2, dp_max=None, mask=None):
         mask (ndarray or None): if not None, should be an (R_Nx,R_Ny) shaped
                     boolean array. Origin is found only where mask==True, and masked
                     arrays are returned for qx0,qy0
+        max_workers (int or None): the number of processes used to find the origins,
+            one scan row at a time. If 1 (default), runs serially in this process. If
+            None, uses all available cores. The worker processes are spawned rather
+            than forked, so that threads started in this process (e.g. by parallel
+            numba kernels) can't deadlock them; scripts calling this with
+            max_workers != 1 must therefore guard their entry point with
+            ``if __name__ == "__main__":``.
+        CUDA (bool): if True, finds the origins on the GPU with cupy, using
+            get_origin_CUDA. max_workers is then ignored.
+        working_dtype (dtype): the floating point type each diffraction pattern is
+            cast to for the calculation. The default single precision halves the
+            memory traffic of the blur and center of mass steps; use np.float64 for
+            full double precision. Ignored if CUDA is True, which always uses float32
 
     Returns:
         (2-tuple of (R_Nx,R_Ny)-shaped ndarrays): the origin, (x,y) at each scan position
@@ -124,52 +217,171 @@ def get_origin(datacube, r=None, rscale=1.2, dp_max=None, mask=None):
 
     qx0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
     qy0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
-    qyy, qxx = np.meshgrid(np.arange(datacube.Q_Ny), np.arange(datacube.Q_Nx))
-
     if mask is None:
-        for (rx, ry) in tqdmnd(
-            datacube.R_Nx,
-            datacube.R_Ny,
-            desc="Finding origins",
-            unit="DP",
-            unit_scale=True,
-        ):
-            dp = datacube.data[rx, ry, :, :]
-            _qx0, _qy0 = np.unravel_index(
-                np.argmax(gaussian_filter(dp, r)), (datacube.Q_Nx, datacube.Q_Ny)
-            )
-            _mask = np.hypot(qxx - _qx0, qyy - _qy0) < r * rscale
-            qx0[rx, ry], qy0[rx, ry] = get_CoM(dp * _mask)
-
+        rows = np.arange(datacube.R_Nx)
     else:
         assert mask.shape == (datacube.R_Nx, datacube.R_Ny)
         assert mask.dtype == bool
-        qx0 = np.ma.array(
-            data=qx0, mask=np.zeros((datacube.R_Nx, datacube.R_Ny), dtype=bool)
-        )
-        qy0 = np.ma.array(
-            data=qy0, mask=np.zeros((datacube.R_Nx, datacube.R_Ny), dtype=bool)
+        # skip scan rows with no active positions entirely
+        rows = np.flatnonzero(np.any(mask, axis=1))
+
+    def _args(rows):
+        return (
+            (
+                datacube.data[rx],
+                r,
+                rscale,
+                None if mask is None else mask[rx],
+                working_dtype,
+            )
+            for rx in rows
         )
-        for (rx, ry) in tqdmnd(
-            datacube.R_Nx,
-            datacube.R_Ny,
-            desc="Finding origins",
-            unit="DP",
-            unit_scale=True,
-        ):
-            if mask[rx, ry]:
-                dp = datacube.data[rx, ry, :, :]
-                _qx0, _qy0 = np.unravel_index(
-                    np.argmax(gaussian_filter(dp, r)), (datacube.Q_Nx, datacube.Q_Ny)
-                )
-                _mask = np.hypot(qxx - _qx0, qyy - _qy0) < r * rscale
-                qx0.data[rx, ry], qy0.data[rx, ry] = get_CoM(dp * _mask)
+
+    if CUDA:
+        from .origin_cuda import get_origin_CUDA
+        qx0, qy0 = get_origin_CUDA(datacube, r, rscale=rscale, mask=mask)
+    else:
+        with tqdm(
+            total=len(rows), desc="Finding origins", unit="row", unit_scale=True
+        ) as pbar:
+            if max_workers == 1:
+                for rx, args in zip(rows, _args(rows)):
+                    qx0[rx], qy0[rx] = _get_origin_row(*args)
+                    pbar.update(1)
             else:
-                qx0.mask, qy0.mask = True, True
+                if max_workers is None:
+                    max_workers = os.cpu_count() or 1
+                with ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=get_context("spawn")
+                ) as executor:
+                    # submit a few rows per worker at a time, so that only a bounded
+                    # number of rows are copied to the workers at once
+                    step = 4 * max_workers
+                    for i in range(0, len(rows), step):
+                        block = rows[i : i + step]
+                        results = executor.map(_get_origin_row, *zip(*_args(block)))
+                        for rx, (_qx0, _qy0) in zip(block, results):
+                            qx0[rx], qy0[rx] = _qx0, _qy0
+                            pbar.update(1)
+
+    if mask is not None:
+        qx0 = np.ma.array(data=qx0, mask=~mask)
+        qy0 = np.ma.array(data=qy0, mask=~mask)
 
     return qx0, qy0
 
 
+def _get_origin_row(dps, r, rscale, mask=None, working_dtype=np.float32):
+    """
+    Finds the origin of each diffraction pattern in a stack, as in get_origin_single_dp.
+    Used by get_origin, where it is run once per scan row.
+
+    Args:
+        dps (ndarray): the (N,Q_Nx,Q_Ny)-shaped stack of diffraction patterns
+        r (number): the approximate disk radius
+        rscale (number): factor by which `r` is scaled to generate a mask
+        mask (ndarray or None): if not None, a length N boolean array. Patterns
+            where mask==False are skipped, and their origins left as zero
+        working_dtype (dtype): the floating point type the patterns are cast to
+
+    Returns:
+        (2-tuple of length N ndarrays): the origins
+    """
+    N, Q_Nx, Q_Ny = dps.shape
+    qx0 = np.zeros(N)
+    qy0 = np.zeros(N)
+    inds = np.arange(N) if mask is None else np.flatnonzero(mask)
+    r2 = (r * rscale) ** 2
+
+    # work through the patterns in tiles small enough that each tile, and its blurred
+    # copy, are still in cache for the argmax and center of mass steps
+    tile = max(1, _TILE_BYTES // (2 * Q_Nx * Q_Ny * np.dtype(working_dtype).itemsize))
+    for t0 in range(0, len(inds), tile):
+        tile_inds = inds[t0 : t0 + tile]
+        dps_tile = dps[t0 : t0 + tile] if mask is None else dps[tile_inds]
+        dps_tile = np.asarray(dps_tile, dtype=working_dtype)
+
+        # blur and find the brightest pixel of all the patterns at once
+        peaks = _gauss_iir_2d(dps_tile, r).reshape(len(tile_inds), -1).argmax(axis=1)
+        _qx0, _qy0 = np.unravel_index(peaks, (Q_Nx, Q_Ny))
+
+        for j, i in enumerate(tile_inds):
+            qx0[i], qy0[i] = _masked_com(dps_tile[j], _qx0[j], _qy0[j], r2)
+    return qx0, qy0
+
+
+def get_origin_single_dp_phasor(dp):
+    """
+    Find the origin for a single diffraction pattern as its circular center of mass,
+    treating each axis as periodic: the pixel coordinates along an axis of length N are
+    mapped to phasors exp(2*pi*i*q/N), and the origin is read off from the angle of
+    their intensity-weighted sum. No peak search or mask is needed, and a disk which
+    wraps around the pattern edge is handled correctly.
+
+    This assumes the center disk dominates the total intensity. Diffuse background pulls
+    the result towards the center of the pattern, and other bright features pull it
+    towards themselves; in these cases use get_origin_single_dp.
+
+    Args:
+        dp (ndarray): the diffraction pattern
+
+    Returns:
+        (2-tuple): The origin, or NaNs if the pattern has no intensity
+    """
+    return _phasor_center(dp.sum(axis=1)), _phasor_center(dp.sum(axis=0))
+
+
+def get_origin_phasor(datacube, mask=None):
+    """
+    Find the origin for all diffraction patterns in a datacube from their circular
+    centers of mass. See get_origin_single_dp_phasor for the method and its assumptions;
+    where these don't hold, use get_origin.
+
+    Args:
+        datacube (DataCube): the data
+        mask (ndarray or None): if not None, should be an (R_Nx,R_Ny) shaped
+            boolean array. Origin is found only where mask==True, and masked
+            arrays are returned for qx0,qy0
+
+    Returns:
+        (2-tuple of (R_Nx,R_Ny)-shaped ndarrays): the origin, (x,y) at each scan position
+    """
+    qx0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
+    qy0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
+    if mask is not None:
+        assert mask.shape == (datacube.R_Nx, datacube.R_Ny)
+        assert mask.dtype == bool
+
+    for rx in tqdmnd(datacube.R_Nx, desc="Finding origins", unit="row", unit_scale=True):
+        dps = datacube.data[rx]
+        if mask is not None:
+            dps = dps[mask[rx]]
+        _qx0 = _phasor_center(dps.sum(axis=2))
+        _qy0 = _phasor_center(dps.sum(axis=1))
+        if mask is None:
+            qx0[rx], qy0[rx] = _qx0, _qy0
+        else:
+            qx0[rx, mask[rx]], qy0[rx, mask[rx]] = _qx0, _qy0
+
+    if mask is not None:
+        qx0 = np.ma.array(data=qx0, mask=~mask)
+        qy0 = np.ma.array(data=qy0, mask=~mask)
+
+    return qx0, qy0
+
+
+def _phasor_center(profiles):
+    """
+    Returns the circular center of mass of each 1D intensity profile along the last axis
+    of `profiles`, in pixels, in the range [0,N), or NaN for a profile with no intensity.
+    """
+    N = profiles.shape[-1]
+    phasors = np.exp(2j * np.pi * np.arange(N) / N)
+    angles = np.angle(np.dot(profiles, phasors))
+    centers = np.mod(angles, 2 * np.pi) * N / (2 * np.pi)
+    return np.where(profiles.sum(axis=-1) == 0, np.nan, centers)[()]
+
+
 def get_origin_from_braggpeaks(braggpeaks, Q_Nx, Q_Ny, findcenter="CoM", bvm=None):
     """
     Gets the diffraction shifts using detected Bragg disk positions.
@@ -204,6 +416,7 @@ def get_origin_from_braggpeaks(braggpeaks, Q_Nx, Q_Ny, findcenter="CoM", bvm=Non
     assert isinstance(findcenter, str), "center must be a str"
     assert findcenter in ["CoM", "max"], "center must be either 'CoM' or 'max'"
     R_Nx, R_Ny = braggpeaks.shape
+    data, counts, _ = _concatenate_braggpeaks(braggpeaks)
 
     # Get guess at position of unscattered beam
     if bvm is None:
@@ -212,48 +425,74 @@ def get_origin_from_braggpeaks(braggpeaks, Q_Nx, Q_Ny, findcenter="CoM", bvm=Non
         braggvectormap_all = bvm
     if findcenter == "max":
         x0, y0 = np.unravel_index(
-            np.argmax(gaussian_filter(braggvectormap_all, 10)), (Q_Nx, Q_Ny)
+            np.argmax(_gauss_iir_2d(braggvectormap_all, 10)), (Q_Nx, Q_Ny)
         )
     else:
         x0, y0 = get_CoM(braggvectormap_all)
-        braggvectormap = np.zeros_like(braggvectormap_all)
-        for Rx in range(R_Nx):
-            for Ry in range(R_Ny):
-                pointlist = braggpeaks.get_pointlist(Rx, Ry)
-                if pointlist.length > 0:
-                    r2 = (pointlist.data["qx"] - x0) ** 2 + (
-                        pointlist.data["qy"] - y0
-                    ) ** 2
-                    index = np.argmin(r2)
-                    braggvectormap = add_to_2D_array_from_floats(
-                        braggvectormap,
-                        pointlist.data["qx"][index],
-                        pointlist.data["qy"][index],
-                        pointlist.data["intensity"][index],
-                    )
+        nearest = _nearest_peaks(data, counts, x0, y0)
+        braggvectormap = add_to_2D_array_from_floats(
+            np.zeros_like(braggvectormap_all),
+            data["qx"][nearest],
+            data["qy"][nearest],
+            data["intensity"][nearest],
+        )
         x0, y0 = get_CoM(braggvectormap)
 
     # Get Bragg peak closest to unscattered beam at each scan position
-    braggvectormap = np.zeros_like(braggvectormap_all)
     qx0 = np.zeros((R_Nx, R_Ny))
     qy0 = np.zeros((R_Nx, R_Ny))
-    for Rx in range(R_Nx):
-        for Ry in range(R_Ny):
-            pointlist = braggpeaks.get_pointlist(Rx, Ry)
-            if pointlist.length > 0:
-                r2 = (pointlist.data["qx"] - x0) ** 2 + (pointlist.data["qy"] - y0) ** 2
-                index = np.argmin(r2)
-                braggvectormap = add_to_2D_array_from_floats(
-                    braggvectormap,
-                    pointlist.data["qx"][index],
-                    pointlist.data["qy"][index],
-                    pointlist.data["intensity"][index],
-                )
-                qx0[Rx, Ry] = pointlist.data["qx"][index]
-                qy0[Rx, Ry] = pointlist.data["qy"][index]
+    nearest = _nearest_peaks(data, counts, x0, y0)
+    braggvectormap = add_to_2D_array_from_floats(
+        np.zeros_like(braggvectormap_all),
+        data["qx"][nearest],
+        data["qy"][nearest],
+        data["intensity"][nearest],
+    )
+    qx0[counts > 0] = data["qx"][nearest]
+    qy0[counts > 0] = data["qy"][nearest]
 
     return qx0, qy0, braggvectormap
 
+def _concatenate_braggpeaks(braggpeaks):
+    """
+    Concatenates all the pointlists of a PointListArray into a single structured array.
+
+    Args:
+        braggpeaks (PointListArray): the Bragg peaks
+
+    Returns:
+        (3-tuple): A 3-tuple comprised of:
+
+            * **data** *(structured array)*: the points at every scan position, with
+              scan positions in C order
+            * **counts** *((R_Nx,R_Ny)-shaped array)*: the number of points at each scan
+              position
+            * **offsets** *(length R_Nx*R_Ny+1 array)*: the points at the i'th scan
+              position in C order are ``data[offsets[i]:offsets[i+1]]``
+    """
+    pointlists = [pointlist for row in braggpeaks.pointlists for pointlist in row]
+    counts = np.array([pointlist.length for pointlist in pointlists], dtype=int)
+    data = np.concatenate([pointlist.data for pointlist in pointlists])
+    offsets = np.zeros(len(counts) + 1, dtype=int)
+    np.cumsum(counts, out=offsets[1:])
+    return data, counts.reshape(braggpeaks.shape), offsets
+
+
+def _nearest_peaks(data, counts, x0, y0):
+    """
+    For the concatenated Bragg peaks returned by _concatenate_braggpeaks, returns the index
+    into data of the peak closest to (x0,y0) at each scan position with any peaks, in C
+    order.  Ties go to the earlier peak, as with np.argmin.
+    """
+    r2 = (data["qx"] - x0) ** 2 + (data["qy"] - y0) ** 2
+    scan_index = np.repeat(np.arange(counts.size), counts.ravel())
+    # stable sort by scan position, then distance, so that each position's nearest peak
+    # comes first among its points
+    order = np.lexsort((r2, scan_index))
+    starts = np.cumsum(counts.ravel()) - counts.ravel()
+    return order[starts[counts.ravel() > 0]]
+
+
 def get_origin_brightest_disk(
         datacube,
         probe_kernel,
@@ -261,14 +500,17 @@ def get_origin_brightest_disk(
         probe_mask_size=None,
         subpixel=None,
         upsample_factor=16,
-        mask=None):    
+        mask=None,
+        working_dtype=np.float32):
     """
     Find the origin for all diffraction patterns in a datacube, by finding the
     brightest peak and then masking around that peak.
 
     Args:
         datacube (DataCube): the data
-        probe_kernel (array): probe kernel for disk detection
+        probe_kernel (array): probe kernel for disk detection. Must be real-valued,
+            as the get_probe_kernel functions return: with subpixel=None, only half
+            of its Fourier transform is used
         qxyInit (array or None): (qx0,qy0) origin for choosing the peak, or `None`.
             If `None`, the origin is the mean diffraction pattern is computed,
             which may be slow for large datasets, and is used to compute
@@ -282,6 +524,8 @@ def get_origin_brightest_disk(
             finding the center.
         probe_mask_std_scale (float): size of Gaussian mask sigma. If set to
             None, function will estimate probe size.
+        working_dtype (dtype): the floating point type of the FFTs used to find the
+            origin when subpixel is None. Use np.float64 for full double precision
 
     Returns:
         2 (R_Nx,R_Ny)-shaped ndarrays: the origin, (x,y) at each scan position
@@ -323,14 +567,21 @@ def get_origin_brightest_disk(
     qx0_ar = np.zeros((datacube.R_Nx,datacube.R_Ny))
     qy0_ar = np.zeros((datacube.R_Nx,datacube.R_Ny))
 
-    for (rx,ry) in tqdmnd(datacube.R_Nx,datacube.R_Ny,desc='Finding origins',unit='DP',unit_scale=True):
-    # for (rx,ry) in tqdmnd(2,2,desc='Finding origins',unit='DP',unit_scale=True):
-        if subpixel is None:
-            dp_corr = np.real(np.fft.ifft2(np.fft.fft2(datacube.data[rx,ry,:,:] * mask) * probe_kernel_FT))
-            ind2D = np.unravel_index(np.argmax(dp_corr), dp_corr.shape)
-            qx0_ar[rx,ry] = ind2D[0]
-            qy0_ar[rx,ry] = ind2D[1]
-        else:
+    if subpixel is None:
+        # cross correlate a whole scan row at a time using real FFTs, with the masked
+        # patterns written into a single reusable buffer
+        probe_kernel_rFT = probe_kernel_FT[:,:datacube.Q_Ny//2+1].astype(
+            np.result_type(working_dtype,np.complex64))
+        dps = np.empty((datacube.R_Ny,datacube.Q_Nx,datacube.Q_Ny),dtype=working_dtype)
+        for rx in tqdmnd(datacube.R_Nx,desc='Finding origins',unit='row',unit_scale=True):
+            np.multiply(datacube.data[rx],mask,out=dps)
+            dps_FT = rfft2(dps)
+            dps_FT *= probe_kernel_rFT
+            dp_corr = irfft2(dps_FT, s=(datacube.Q_Nx,datacube.Q_Ny), overwrite_x=True)
+            inds = np.argmax(dp_corr.reshape(datacube.R_Ny,-1),axis=1)
+            qx0_ar[rx],qy0_ar[rx] = np.unravel_index(inds,(datacube.Q_Nx,datacube.Q_Ny))
+    else:
+        for (rx,ry) in tqdmnd(datacube.R_Nx,datacube.R_Ny,desc='Finding origins',unit='DP',unit_scale=True):
             peaks = _find_Bragg_disks_single_DP_FK(
                 datacube.data[rx,ry,:,:] * mask,
                 probe_kernel_FT,
@@ -348,7 +599,8 @@ def get_origin_brightest_disk(
 
     return qx0_ar, qy0_ar
 
-def get_origin_single_dp_beamstop(DP: np.ndarray,mask: np.ndarray):
+def get_origin_single_dp_beamstop(DP: np.ndarray,mask: np.ndarray,
+                                  working_dtype=np.float32):
     """
     Find the origin for a single diffraction pattern, assuming there is a beam stop.
 
@@ -358,27 +610,40 @@ def get_origin_single_dp_beamstop(DP: np.ndarray,mask: np.ndarray):
             in the diffraction pattern. One approach to generating this mask
             is to apply a suitable threshold on the average diffraction pattern
             and use binary opening/closing to remove and holes
+        working_dtype (dtype): the floating point type of the FFTs. Use np.float64
+            for full double precision
 
     Returns:
         qx0, qy0 (tuple) measured center position of diffraction pattern
     """
 
-    imCorr = np.real(
-        np.fft.ifft2(
-            np.fft.fft2(DP * mask)
-            * np.conj(np.fft.fft2(np.rot90(DP, 2) * np.rot90(mask, 2)))
-        )
-    )
+    return _get_origin_masked_dp_beamstop(np.multiply(DP, mask, dtype=working_dtype))
 
-    xp, yp = np.unravel_index(np.argmax(imCorr), imCorr.shape)
 
-    dx = ((xp + DP.shape[0] / 2) % DP.shape[0]) - DP.shape[0] / 2
-    dy = ((yp + DP.shape[1] / 2) % DP.shape[1]) - DP.shape[1] / 2
+def _get_origin_masked_dp_beamstop(DP_masked):
+    """
+    Finds the origin of DP*mask, as in get_origin_single_dp_beamstop. DP_masked is
+    used as scratch space, and is overwritten.
+    """
+    # The cross correlation of DP*mask with its 180 degree rotation equals the
+    # autoconvolution of DP*mask shifted by one pixel along each axis, which needs only
+    # a single real FFT
+    F = rfft2(DP_masked, overwrite_x=True)
+    F *= F
+    imConv = irfft2(F, s=DP_masked.shape, overwrite_x=True)
+
+    xp, yp = np.unravel_index(np.argmax(imConv), imConv.shape)
+    xp, yp = xp + 1, yp + 1
+
+    shape = DP_masked.shape
+    dx = ((xp + shape[0] / 2) % shape[0]) - shape[0] / 2
+    dy = ((yp + shape[1] / 2) % shape[1]) - shape[1] / 2
 
-    return (DP.shape[0] + dx) / 2, (DP.shape[1] + dy) / 2
+    return (shape[0] + dx) / 2, (shape[1] + dy) / 2
 
 
-def get_origin_beamstop(datacube: DataCube, mask: np.ndarray):
+def get_origin_beamstop(datacube: DataCube, mask: np.ndarray,
+                        working_dtype=np.float32):
     """
     Find the origin for each diffraction pattern, assuming there is a beam stop.
 
@@ -388,6 +653,8 @@ def get_origin_beamstop(datacube: DataCube, mask: np.ndarray):
             in the diffraction pattern. One approach to generating this mask
             is to apply a suitable threshold on the average diffraction pattern
             and use binary opening/closing to remove any holes
+        working_dtype (dtype): the floating point type of the FFTs. Use np.float64
+            for full double precision
 
     Returns:
         qx0, qy0 (tuple of np arrays) measured center position of each diffraction pattern
@@ -396,8 +663,11 @@ def get_origin_beamstop(datacube: DataCube, mask: np.ndarray):
     qx0 = np.zeros(datacube.data.shape[:2])
     qy0 = np.zeros_like(qx0)
 
+    # mask each pattern into the same preallocated buffer
+    DP_masked = np.empty((datacube.Q_Nx, datacube.Q_Ny), dtype=working_dtype)
     for rx, ry in tqdmnd(datacube.R_Nx, datacube.R_Ny):
-        x, y = get_origin_single_dp_beamstop(datacube.data[rx, ry, :, :], mask)
+        np.multiply(datacube.data[rx, ry, :, :], mask, out=DP_masked)
+        x, y = _get_origin_masked_dp_beamstop(DP_masked)
 
         qx0[rx,ry] = x
         qy0[rx,ry] = y
@@ -426,53 +696,20 @@ def get_origin_beamstop_braggpeaks(braggpeaks,center_guess,radii,Q_Nx,Q_Ny,
     R_Nx,R_Ny = braggpeaks.shape
 
     # remove peaks outside the annulus
-    braggpeaks_masked = braggpeaks.copy()
-    for rx in range(R_Nx):
-        for ry in range(R_Ny):
-            pl = braggpeaks_masked.get_pointlist(rx,ry)
-            qr = np.hypot(pl.data['qx']-center_guess[0],
-                          pl.data['qy']-center_guess[1])
-            rm = np.logical_not(np.logical_and(qr>=radii[0],qr<=radii[1]))
-            pl.remove_points(rm)
+    data,counts,offsets = _concatenate_braggpeaks(braggpeaks)
+    qr = np.hypot(data['qx']-center_guess[0],
+                  data['qy']-center_guess[1])
+    keep = np.logical_and(qr>=radii[0],qr<=radii[1])
+    qx,qy = data['qx'][keep],data['qy'][keep]
+    offsets = np.concatenate(([0],np.cumsum(keep)))[offsets]
 
     # Find all matching conjugate pairs of peaks
     center_curr = center_guess
     for ii in range(max_iter):
-        centers = np.zeros((R_Nx,R_Ny,2))
-        found_center = np.zeros((R_Nx,R_Ny),dtype=bool)
-        for rx in range(R_Nx):
-            for ry in range(R_Ny):
-
-                # Get data
-                pl = braggpeaks_masked.get_pointlist(rx,ry)
-                is_paired = np.zeros(len(pl.data),dtype=bool)
-                matches = []
-
-                # Find matching pairs
-                for i in range(len(pl.data)):
-                    if not is_paired[i]:
-                        x,y = pl.data['qx'][i],pl.data['qy'][i]
-                        x_r = -x+2*center_curr[0]
-                        y_r = -y+2*center_curr[1]
-                        dists = np.hypot(x_r-pl.data['qx'],y_r-pl.data['qy'])
-                        dists[is_paired] = 2*max_dist
-                        matched = dists<=max_dist
-                        if(any(matched)):
-                            match = np.argmin(dists)
-                            matches.append((i,match))
-                            is_paired[i],is_paired[match] = True,True
-
-                # Find the center
-                if len(matches)>0:
-                    x0,y0 = [],[]
-                    for i in range(len(matches)):
-                        x0.append(np.mean(pl.data['qx'][list(matches[i])]))
-                        y0.append(np.mean(pl.data['qy'][list(matches[i])]))
-                    x0,y0 = np.mean(x0),np.mean(y0)
-                    centers[rx,ry,:] = x0,y0
-                    found_center[rx,ry] = True
-                else:
-                    found_center[rx,ry] = False
+        centers,found_center = _find_conjugate_centers(
+            qx,qy,offsets,float(center_curr[0]),float(center_curr[1]),max_dist)
+        centers = centers.reshape((R_Nx,R_Ny,2))
+        found_center = found_center.reshape((R_Nx,R_Ny))
 
         # Update current center guess
         x0_curr = np.mean(centers[found_center,0])
@@ -623,64 +860,7 @@ def find_outlier_shifts(xshifts, yshifts, n_sigma=10, edge_boundary=0):
         cutoff          (float) the score cutoff value
     """
     # Get score
-    score = np.zeros_like(xshifts)
-    score[:-1, :] += np.abs(
-        xshifts[:-1, :] - np.roll(xshifts, (-1, 0), axis=(0, 1))[:-1, :]
-    )
-    score[1:, :] += np.abs(
-        xshifts[1:, :] - np.roll(xshifts, (1, 0), axis=(0, 1))[1:, :]
-    )
-    score[:, :-1] += np.abs(
-        xshifts[:, :-1] - np.roll(xshifts, (0, -1), axis=(0, 1))[:, :-1]
-    )
-    score[:, 1:] += np.abs(
-        xshifts[:, 1:] - np.roll(xshifts, (0, 1), axis=(0, 1))[:, 1:]
-    )
-    score[:-1, :-1] += np.abs(
-        xshifts[:-1, :-1] - np.roll(xshifts, (-1, -1), axis=(0, 1))[:-1, :-1]
-    )
-    score[1:, :-1] += np.abs(
-        xshifts[1:, :-1] - np.roll(xshifts, (1, -1), axis=(0, 1))[1:, :-1]
-    )
-    score[:-1, 1:] += np.abs(
-        xshifts[:-1, 1:] - np.roll(xshifts, (-1, 1), axis=(0, 1))[:-1, 1:]
-    )
-    score[1:, 1:] += np.abs(
-        xshifts[1:, 1:] - np.roll(xshifts, (1, 1), axis=(0, 1))[1:, 1:]
-    )
-    score[:-1, :] += np.abs(
-        yshifts[:-1, :] - np.roll(yshifts, (-1, 0), axis=(0, 1))[:-1, :]
-    )
-    score[1:, :] += np.abs(
-        yshifts[1:, :] - np.roll(yshifts, (1, 0), axis=(0, 1))[1:, :]
-    )
-    score[:, :-1] += np.abs(
-        yshifts[:, :-1] - np.roll(yshifts, (0, -1), axis=(0, 1))[:, :-1]
-    )
-    score[:, 1:] += np.abs(
-        yshifts[:, 1:] - np.roll(yshifts, (0, 1), axis=(0, 1))[:, 1:]
-    )
-    score[:-1, :-1] += np.abs(
-        yshifts[:-1, :-1] - np.roll(yshifts, (-1, -1), axis=(0, 1))[:-1, :-1]
-    )
-    score[1:, :-1] += np.abs(
-        yshifts[1:, :-1] - np.roll(yshifts, (1, -1), axis=(0, 1))[1:, :-1]
-    )
-    score[:-1, 1:] += np.abs(
-        yshifts[:-1, 1:] - np.roll(yshifts, (-1, 1), axis=(0, 1))[:-1, 1:]
-    )
-    score[1:, 1:] += np.abs(
-        yshifts[1:, 1:] - np.roll(yshifts, (1, 1), axis=(0, 1))[1:, 1:]
-    )
-    score[1:-1, 1:-1] /= 8.0
-    score[:1, 1:-1] /= 5.0
-    score[-1:, 1:-1] /= 5.0
-    score[1:-1, :1] /= 5.0
-    score[1:-1, -1:] /= 5.0
-    score[0, 0] /= 3.0
-    score[0, -1] /= 3.0
-    score[-1, 0] /= 3.0
-    score[-1, -1] /= 3.0
+    score = _outlier_score(xshifts, yshifts)
 
     # Get mask and return
     cutoff = np.std(score) * n_sigma
@@ -729,20 +909,194 @@ def center_braggpeaks(braggpeaks, qx0=None, qy0=None, coords=None, name=None):
         )
         name = _name + "_centered"
     assert isinstance(name, str)
-    braggpeaks_centered = braggpeaks.copy(name=name)
 
+    # shift all the peaks at once, then split them back up by scan position
+    data, counts, offsets = _concatenate_braggpeaks(braggpeaks)
     if np.isscalar(qx0) & np.isscalar(qy0):
-        for Rx in range(braggpeaks_centered.shape[0]):
-            for Ry in range(braggpeaks_centered.shape[1]):
-                pointlist = braggpeaks_centered.get_pointlist(Rx, Ry)
-                pointlist.data["qx"] -= qx0
-                pointlist.data["qy"] -= qy0
+        data["qx"] -= qx0
+        data["qy"] -= qy0
     else:
-        for Rx in range(braggpeaks_centered.shape[0]):
-            for Ry in range(braggpeaks_centered.shape[1]):
-                pointlist = braggpeaks_centered.get_pointlist(Rx, Ry)
-                qx, qy = qx0[Rx, Ry], qy0[Rx, Ry]
-                pointlist.data["qx"] -= qx
-                pointlist.data["qy"] -= qy
+        data["qx"] -= np.repeat(np.ravel(qx0), counts.ravel())
+        data["qy"] -= np.repeat(np.ravel(qy0), counts.ravel())
+
+    braggpeaks_centered = PointListArray(
+        coordinates=braggpeaks.coordinates,
+        shape=braggpeaks.shape,
+        dtype=braggpeaks.default_dtype,
+        name=name,
+    )
+    for i, (Rx, Ry) in enumerate(np.ndindex(braggpeaks.shape)):
+        braggpeaks_centered.get_pointlist(Rx, Ry).add_dataarray(
+            data[offsets[i] : offsets[i + 1]]
+        )
 
     return braggpeaks_centered
+
+
+# Center of mass of the pixels of dp within sqrt(r2) of the integer pixel (cx,cy), with
+# and without numba acceleration.  Equivalent to get_CoM(dp*mask) for the corresponding
+# circular mask, without allocating the mask or the masked pattern.
+import sys
+if 'numba' in sys.modules:
+
+    @nb.njit(fastmath=True, cache=True)
+    def _masked_com(dp, cx, cy, r2):
+        s = 0.0
+        sx = 0.0
+        sy = 0.0
+        for i in range(dp.shape[0]):
+            dx2 = (i - cx) ** 2
+            for j in range(dp.shape[1]):
+                if dx2 + (j - cy) ** 2 < r2:
+                    v = dp[i, j]
+                    s += v
+                    sx += v * i
+                    sy += v * j
+        if s == 0:
+            return np.nan, np.nan
+        return sx / s, sy / s
+
+else:
+
+    def _masked_com(dp, cx, cy, r2):
+        # int32 coordinates halve the size of the squared-distance temporaries
+        qx = np.arange(dp.shape[0], dtype=np.int32)
+        qy = np.arange(dp.shape[1], dtype=np.int32)
+        d2 = (qx[:, None] - int(cx)) ** 2 + (qy - int(cy)) ** 2
+        masked = np.where(d2 < r2, dp, 0)
+        tot_intens = np.sum(masked)
+        return (
+            np.dot(qx, masked.sum(axis=1)) / tot_intens,
+            np.dot(masked.sum(axis=0), qy) / tot_intens,
+        )
+
+
+# Conjugate pair matching for get_origin_beamstop_braggpeaks, with and without numba
+# acceleration.  qx,qy are the peaks at all scan positions, concatenated, with the peaks at
+# the n'th scan position in qx[offsets[n]:offsets[n+1]].  At each position, each unpaired
+# peak is paired with the nearest unpaired peak to its reflection through (cx,cy), if that
+# is within max_dist.  Returns the (N,2) array of the mean center of the pairs at each of
+# the N scan positions, and the length N boolean array of where any pairs were found.
+if 'numba' in sys.modules:
+
+    @nb.njit(cache=True)
+    def _find_conjugate_centers(qx,qy,offsets,cx,cy,max_dist):
+        N = len(offsets)-1
+        centers = np.zeros((N,2))
+        found_center = np.zeros(N,dtype=np.bool_)
+        for n in range(N):
+            start,stop = offsets[n],offsets[n+1]
+            is_paired = np.zeros(stop-start,dtype=np.bool_)
+            x0,y0,n_matches = 0.0,0.0,0
+            for i in range(start,stop):
+                if is_paired[i-start]:
+                    continue
+                x_r = -qx[i]+2*cx
+                y_r = -qy[i]+2*cy
+                match,match_dist = -1,np.inf
+                for j in range(start,stop):
+                    if not is_paired[j-start]:
+                        d = np.hypot(x_r-qx[j],y_r-qy[j])
+                        if d<match_dist:
+                            match,match_dist = j,d
+                if match_dist<=max_dist:
+                    x0 += (qx[i]+qx[match])/2
+                    y0 += (qy[i]+qy[match])/2
+                    n_matches += 1
+                    is_paired[i-start],is_paired[match-start] = True,True
+            if n_matches>0:
+                centers[n,0],centers[n,1] = x0/n_matches,y0/n_matches
+                found_center[n] = True
+        return centers,found_center
+
+else:
+
+    def _find_conjugate_centers(qx,qy,offsets,cx,cy,max_dist):
+        N = len(offsets)-1
+        centers = np.zeros((N,2))
+        found_center = np.zeros(N,dtype=bool)
+        for n in range(N):
+
+            # Get data
+            x_all = qx[offsets[n]:offsets[n+1]]
+            y_all = qy[offsets[n]:offsets[n+1]]
+            is_paired = np.zeros(len(x_all),dtype=bool)
+            matches = []
+
+            # Find matching pairs
+            for i in range(len(x_all)):
+                if not is_paired[i]:
+                    x,y = x_all[i],y_all[i]
+                    x_r = -x+2*cx
+                    y_r = -y+2*cy
+                    dists = np.hypot(x_r-x_all,y_r-y_all)
+                    dists[is_paired] = 2*max_dist
+                    matched = dists<=max_dist
+                    if(any(matched)):
+                        match = np.argmin(dists)
+                        matches.append((i,match))
+                        is_paired[i],is_paired[match] = True,True
+
+            # Find the center
+            if len(matches)>0:
+                x0,y0 = [],[]
+                for i in range(len(matches)):
+                    x0.append(np.mean(x_all[list(matches[i])]))
+                    y0.append(np.mean(y_all[list(matches[i])]))
+                centers[n,:] = np.mean(x0),np.mean(y0)
+                found_center[n] = True
+
+        return centers,found_center
+
+
+# Score function for find_outlier_shifts, with and without numba acceleration: the mean
+# over the (up to 8) nearest neighbors of each scan position of the sum of the absolute
+# differences of the x and y shifts there and at the neighbor, or 0 for a position with no
+# neighbors.  Neighbors are summed in the order below, x before y.
+_NEIGHBORS = np.array(
+    [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1)]
+)
+if 'numba' in sys.modules:
+
+    @nb.njit(cache=True)
+    def _outlier_score(xshifts, yshifts):
+        Nx, Ny = xshifts.shape
+        score = np.zeros(xshifts.shape)
+        for i in range(Nx):
+            for j in range(Ny):
+                acc = 0.0
+                count = 0
+                for k in range(len(_NEIGHBORS)):
+                    ii, jj = i + _NEIGHBORS[k, 0], j + _NEIGHBORS[k, 1]
+                    if 0 <= ii < Nx and 0 <= jj < Ny:
+                        acc += abs(xshifts[i, j] - xshifts[ii, jj])
+                        count += 1
+                for k in range(len(_NEIGHBORS)):
+                    ii, jj = i + _NEIGHBORS[k, 0], j + _NEIGHBORS[k, 1]
+                    if 0 <= ii < Nx and 0 <= jj < Ny:
+                        acc += abs(yshifts[i, j] - yshifts[ii, jj])
+                if count > 0:
+                    score[i, j] = acc / count
+        return score
+
+else:
+
+    def _outlier_score(xshifts, yshifts):
+        Nx, Ny = xshifts.shape
+        score = np.zeros(xshifts.shape)
+        count = np.zeros(xshifts.shape)
+        for k, shifts in enumerate((xshifts, yshifts)):
+            for di, dj in _NEIGHBORS:
+                # positions whose (di,dj) neighbor is in bounds, and those neighbors
+                here = (
+                    slice(max(0, -di), Nx - max(0, di)),
+                    slice(max(0, -dj), Ny - max(0, dj)),
+                )
+                there = (
+                    slice(max(0, di), Nx - max(0, -di)),
+                    slice(max(0, dj), Ny - max(0, -dj)),
+                )
+                score[here] += np.abs(shifts[here] - shifts[there])
+                if k == 0:
+                    count[here] += 1
+        return np.divide(score, count, out=score, where=count > 0)
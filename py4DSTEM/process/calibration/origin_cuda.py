@@ -0,0 +1,74 @@
+'''
+Functions for finding the origin using cupy
+
+'''
+
+import numpy as np
+import cupy as cp
+from cupyx.scipy.ndimage import gaussian_filter
+from tqdm import tqdm
+
+
+def get_origin_CUDA(datacube, r, rscale=1.2, mask=None):
+    """
+    Find the origin for all diffraction patterns in a datacube on the GPU, assuming (a)
+    there is no beam stop, and (b) the center beam contains the highest intensity. See
+    get_origin for the CPU implementation, which dispatches here when CUDA=True.
+
+    Blocks of scan rows are copied to the GPU in turn, sized to fit in the free GPU
+    memory. Each block is blurred along the diffraction axes, the brightest pixel of each
+    pattern is found, and the center of mass of the pixels within r*rscale of it is
+    computed, all as whole-block array operations.
+
+    Args:
+        datacube (DataCube): the data
+        r (number): the approximate radius of the center disk
+        rscale (number): expand 'r' by this amount to form a mask about the center disk
+            when taking its center of mass
+        mask (ndarray or None): if not None, an (R_Nx,R_Ny) shaped boolean array. The
+            origin is left as zero where mask==False
+
+    Returns:
+        (2-tuple of (R_Nx,R_Ny)-shaped ndarrays): the origin, (x,y) at each scan position
+    """
+    R_Nx, R_Ny, Q_Nx, Q_Ny = datacube.data.shape
+    qx0 = np.zeros((R_Nx, R_Ny))
+    qy0 = np.zeros((R_Nx, R_Ny))
+    qx = cp.arange(Q_Nx)
+    qy = cp.arange(Q_Ny)
+    r2 = (r * rscale) ** 2
+
+    # each pixel needs ~20 bytes of GPU memory: the float32 data and its blurred copy,
+    # the int64 squared distances, and the boolean disk mask
+    free_bytes, _ = cp.cuda.Device().mem_info
+    step = int(np.clip(free_bytes // (20 * R_Ny * Q_Nx * Q_Ny), 1, R_Nx))
+
+    for rx0 in tqdm(
+        range(0, R_Nx, step), desc="Finding origins", unit="block", unit_scale=True
+    ):
+        rx1 = min(rx0 + step, R_Nx)
+        data = cp.asarray(datacube.data[rx0:rx1], dtype=cp.float32)
+
+        # brightest pixel of each blurred pattern
+        peaks = gaussian_filter(data, sigma=(0, 0, r, r))
+        peaks = peaks.reshape(rx1 - rx0, R_Ny, -1).argmax(axis=-1)
+        _qx0 = (peaks // Q_Ny)[:, :, None, None]
+        _qy0 = (peaks % Q_Ny)[:, :, None, None]
+        del peaks
+
+        # center of mass within the disk about each brightest pixel
+        data *= (qx[:, None] - _qx0) ** 2 + (qy[None, :] - _qy0) ** 2 < r2
+        tot_intens = data.sum(axis=(2, 3), dtype=cp.float64)
+        qx0[rx0:rx1] = cp.asnumpy(
+            (data.sum(axis=3, dtype=cp.float64) * qx).sum(axis=-1) / tot_intens
+        )
+        qy0[rx0:rx1] = cp.asnumpy(
+            (data.sum(axis=2, dtype=cp.float64) * qy).sum(axis=-1) / tot_intens
+        )
+        del data
+
+    if mask is not None:
+        qx0[~mask] = 0
+        qy0[~mask] = 0
+
+    return qx0, qy0
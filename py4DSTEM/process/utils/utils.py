@@ -503,20 +503,29 @@ def add_to_2D_array_from_floats(ar, x, y, I):
     """
     Adds the values I to array ar, distributing the value between the four pixels nearest
     (x,y) using linear interpolation.  Inputs (x,y,I) may be floats or arrays of floats.
-
-    Note that if the same [x,y] coordinate appears more than once in the input array,
-    only the *final* value of I at that coordinate will get added.
+    Values landing on the same pixel all accumulate, so many points may be added in a
+    single call.
     """
     Nx, Ny = ar.shape
+    x, y, I = np.asarray(x), np.asarray(y), np.asarray(I)
     x0, x1 = (np.floor(x)).astype(int), (np.ceil(x)).astype(int)
     y0, y1 = (np.floor(y)).astype(int), (np.ceil(y)).astype(int)
     mask = np.logical_and(np.logical_and(np.logical_and((x0>=0),(y0>=0)),(x1<Nx)),(y1<Ny))
-    dx = x - x0
-    dy = y - y0
-    ar[x0[mask], y0[mask]] += (1 - dx[mask]) * (1 - dy[mask]) * I[mask]
-    ar[x0[mask], y1[mask]] += (1 - dx[mask]) * (    dy[mask]) * I[mask]
-    ar[x1[mask], y0[mask]] += (    dx[mask]) * (1 - dy[mask]) * I[mask]
-    ar[x1[mask], y1[mask]] += (    dx[mask]) * (    dy[mask]) * I[mask]
+    x0, x1, y0, y1 = x0[mask], x1[mask], y0[mask], y1[mask]
+    dx = x[mask] - x0
+    dy = y[mask] - y0
+    I = I[mask]
+    # accumulate with bincount over flat indices, which is much faster than np.add.at
+    inds = np.ravel_multi_index(
+        (np.concatenate((x0, x0, x1, x1)), np.concatenate((y0, y1, y0, y1))), (Nx, Ny)
+    )
+    weights = np.concatenate((
+        (1 - dx) * (1 - dy) * I,
+        (1 - dx) * (    dy) * I,
+        (    dx) * (1 - dy) * I,
+        (    dx) * (    dy) * I,
+    ))
+    ar += np.bincount(inds, weights, minlength=Nx * Ny).reshape(Nx, Ny)
     return ar
 
 
@@ -544,7 +553,7 @@ def print_progress_bar(iteration, total, prefix='', suffix='', decimals=1,
         print()
 
 
-def bin2D(array, factor, dtype=np.float64):
+def bin2D(array, factor, dtype=np.float64, out=None):
     """
     Bin a 2D ndarray by binfactor.
 
@@ -553,6 +562,9 @@ def bin2D(array, factor, dtype=np.float64):
         factor (int): the binning factor
         dtype (numpy dtype): datatype for binned array. default is numpy default for
             np.zeros()
+        out (2D numpy array, optional): if passed, the binned array is written here
+            instead of into a newly allocated array.  Must have the binned shape and
+            datatype dtype.  Useful when binning many arrays in a loop.
 
     Returns:
         the binned array
@@ -562,7 +574,13 @@ def bin2D(array, factor, dtype=np.float64):
     xx, yy = binx * factor, biny * factor
 
     # Make a binned array on the device
-    binned_ar = np.zeros((binx, biny), dtype=dtype)
+    if out is None:
+        binned_ar = np.zeros((binx, biny), dtype=dtype)
+    else:
+        assert out.shape == (binx, biny), "out must have the binned shape"
+        assert out.dtype == dtype, "out must have datatype dtype"
+        binned_ar = out
+        binned_ar[:] = 0
     array = array.astype(dtype)
 
     # Collect pixel sums into new bins
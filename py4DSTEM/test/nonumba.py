@@ -0,0 +1,34 @@
+# Helpers for testing modules both with and without numba
+
+import sys
+import importlib
+import importlib.abc
+from unittest import mock
+
+
+def import_without_numba(name):
+    """
+    Imports a fresh copy of the module name as if numba were not installed, so that its
+    NumPy fallbacks can be tested alongside its numba kernels.  The module already
+    imported under name is left in place.
+    """
+    class _BlockNumba(importlib.abc.MetaPathFinder):
+        def find_spec(self, fullname, path, target=None):
+            if fullname.split(".")[0] == "numba":
+                raise ImportError(fullname)
+
+    parent, _, child = name.rpartition(".")
+    importlib.import_module(parent)
+    with mock.patch.dict(sys.modules):
+        for key in list(sys.modules):
+            if key == name or key.split(".")[0] == "numba":
+                del sys.modules[key]
+        sys.meta_path.insert(0, _BlockNumba())
+        try:
+            module = importlib.import_module(name)
+        finally:
+            sys.meta_path.pop(0)
+    # importing rebinds the attribute on the parent package, which patch.dict doesn't undo
+    if name in sys.modules:
+        setattr(sys.modules[parent], child, sys.modules[name])
+    return module
@@ -0,0 +1,86 @@
+# Tests for the pymultislicer reader and writer
+
+import os
+import unittest
+import numpy as np
+
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from py4DSTEM.io import DataCube
+from py4DSTEM.io.nonnative import pymultislicer
+from py4DSTEM.process.utils import bin2D
+from py4DSTEM.test.nonumba import import_without_numba
+
+pymultislicer_nonumba = import_without_numba("py4DSTEM.io.nonnative.pymultislicer")
+
+
+class TestPymultislicer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        # a 6x4 scan; the filename encodes the scan shape as _x<R_Ny>_y<R_Nx>
+        self.data = (
+            100 * np.random.default_rng(0).random((6, 4, 128, 128))
+        ).astype(np.float32)
+        self.datacube = DataCube(data=self.data)
+        self.fp = os.path.join(self.tmpdir, "test_x4_y6.raw")
+        pymultislicer.save_pymultislicer(self.datacube, self.fp)
+
+    def _binned(self, data, binfactor):
+        # bin each diffraction pattern with bin2D
+        return np.array([
+            [bin2D(dp, binfactor, dtype=np.float32) for dp in row] for row in data
+        ])
+
+    def test_read_RAM(self):
+        dc = pymultislicer.read_pymultislicer(self.fp)
+        self.assertTrue(np.array_equal(dc.data, self.data))
+
+    def test_read_MEMMAP(self):
+        dc = pymultislicer.read_pymultislicer(self.fp, mem="MEMMAP")
+        self.assertIsInstance(dc.data, np.memmap)
+        self.assertTrue(np.array_equal(dc.data, self.data))
+
+    def test_read_binned(self):
+        for module in (pymultislicer, pymultislicer_nonumba):
+            for binfactor in [2, 3]:
+                ans = self._binned(self.data, binfactor)
+                for mem in ["RAM", "MEMMAP"]:
+                    dc = module.read_pymultislicer(self.fp, mem=mem, binfactor=binfactor)
+                    self.assertEqual(dc.data.shape, ans.shape)
+                    np.testing.assert_allclose(dc.data, ans, rtol=1e-5)
+                    if mem == "MEMMAP":
+                        self.assertIsInstance(dc.data, np.memmap)
+
+    def test_raw_dtype(self):
+        data = np.round(self.data).astype(np.uint16)
+        fp = os.path.join(self.tmpdir, "test_uint16_x4_y6.raw")
+        pymultislicer.save_pymultislicer(DataCube(data=data), fp, raw_dtype=np.uint16)
+        self.assertEqual(os.path.getsize(fp), data.size * 130 // 128 * 2)
+        for mem in ["RAM", "MEMMAP"]:
+            dc = pymultislicer.read_pymultislicer(fp, mem=mem, raw_dtype=np.uint16)
+            self.assertTrue(np.array_equal(dc.data, data))
+        dc = pymultislicer.read_pymultislicer(fp, binfactor=2, raw_dtype=np.uint16)
+        np.testing.assert_allclose(dc.data, self._binned(data, 2), rtol=1e-5)
+
+    def test_transpose(self):
+        fp = os.path.join(self.tmpdir, "test_transposed_x4_y6.raw")
+        pymultislicer.save_pymultislicer(self.datacube, fp, transpose=True)
+        for mem in ["RAM", "MEMMAP"]:
+            dc = pymultislicer.read_pymultislicer(fp, mem=mem, transpose=True)
+            self.assertTrue(np.array_equal(dc.data, self.data))
+
+    def test_save_requires_128x128(self):
+        datacube = DataCube(data=self.data[:, :, :64, :64])
+        fp = os.path.join(self.tmpdir, "test_small_x4_y6.raw")
+        for transpose in [False, True]:
+            with self.assertRaises(AssertionError):
+                pymultislicer.save_pymultislicer(datacube, fp, transpose=transpose)
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
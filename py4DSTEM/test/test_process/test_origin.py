@@ -0,0 +1,481 @@
+# Tests for the origin finding module
+
+import importlib.util
+import unittest
+from unittest import mock
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from py4DSTEM.io import DataCube, PointListArray
+from py4DSTEM.process.utils import get_CoM, add_to_2D_array_from_floats
+from py4DSTEM.process.calibration import origin
+from py4DSTEM.test.nonumba import import_without_numba
+
+origin_nonumba = import_without_numba("py4DSTEM.process.calibration.origin")
+
+
+def _get_origin_single_dp_reference(dp, r, rscale=1.2):
+    # the original implementation of get_origin_single_dp
+    Q_Nx, Q_Ny = dp.shape
+    _qx0, _qy0 = np.unravel_index(np.argmax(gaussian_filter(dp, r)), (Q_Nx, Q_Ny))
+    qyy, qxx = np.meshgrid(np.arange(Q_Ny), np.arange(Q_Nx))
+    mask = np.hypot(qxx - _qx0, qyy - _qy0) < r * rscale
+    return get_CoM(dp * mask)
+
+
+def _make_datacube(R_Nx=4, R_Ny=5, Q_Nx=48, Q_Ny=40, r=4, seed=0):
+    # a disk of radius r with soft edges at a random subpixel position in each pattern,
+    # on a weak background
+    rng = np.random.default_rng(seed)
+    qx0 = Q_Nx / 2 + rng.uniform(-3, 3, (R_Nx, R_Ny))
+    qy0 = Q_Ny / 2 + rng.uniform(-3, 3, (R_Nx, R_Ny))
+    qyy, qxx = np.meshgrid(np.arange(Q_Ny), np.arange(Q_Nx))
+    data = np.empty((R_Nx, R_Ny, Q_Nx, Q_Ny))
+    for rx, ry in np.ndindex(R_Nx, R_Ny):
+        d = np.hypot(qxx - qx0[rx, ry], qyy - qy0[rx, ry])
+        data[rx, ry] = np.clip(r + 0.5 - d, 0, 1) + 0.01 * rng.random((Q_Nx, Q_Ny))
+    return DataCube(data=data), qx0, qy0
+
+
+def _get_origin_single_dp_beamstop_reference(DP, mask):
+    # the original implementation of get_origin_single_dp_beamstop
+    imCorr = np.real(
+        np.fft.ifft2(
+            np.fft.fft2(DP * mask)
+            * np.conj(np.fft.fft2(np.rot90(DP, 2) * np.rot90(mask, 2)))
+        )
+    )
+    xp, yp = np.unravel_index(np.argmax(imCorr), imCorr.shape)
+    dx = ((xp + DP.shape[0] / 2) % DP.shape[0]) - DP.shape[0] / 2
+    dy = ((yp + DP.shape[1] / 2) % DP.shape[1]) - DP.shape[1] / 2
+    return (DP.shape[0] + dx) / 2, (DP.shape[1] + dy) / 2
+
+
+def _make_beamstop_datacube(Q_Nx, Q_Ny, dtype, R_Nx=3, R_Ny=4, seed=0):
+    # patterns which are symmetric about a random center, plus noise, and a beamstop
+    # arm running from the center to the edge
+    rng = np.random.default_rng(seed)
+    qyy, qxx = np.meshgrid(np.arange(Q_Ny), np.arange(Q_Nx))
+    data = np.empty((R_Nx, R_Ny, Q_Nx, Q_Ny))
+    for rx, ry in np.ndindex(R_Nx, R_Ny):
+        x0 = Q_Nx / 2 + rng.uniform(-3, 3)
+        y0 = Q_Ny / 2 + rng.uniform(-3, 3)
+        r = np.hypot(qxx - x0, qyy - y0)
+        data[rx, ry] = (
+            np.exp(-r ** 2 / 8) + 0.5 * np.exp(-(r - 12) ** 2 / 2)
+            + 0.05 * rng.random((Q_Nx, Q_Ny))
+        )
+    mask = np.ones((Q_Nx, Q_Ny), dtype=bool)
+    mask[Q_Nx // 2 - 2 : Q_Nx // 2 + 2, : Q_Ny // 2] = False
+    if np.issubdtype(dtype, np.integer):
+        data = np.round(1000 * data)
+    return DataCube(data=data.astype(dtype)), mask
+
+
+def _make_braggpeaks(R_Nx=3, R_Ny=4, seed=0):
+    # at each scan position, a central peak near (32,32) with pairs of peaks placed
+    # nearly symmetrically about it, some unpaired peaks, and no peaks at all at (1,2)
+    rng = np.random.default_rng(seed)
+    braggpeaks = PointListArray(
+        coordinates=[("qx", float), ("qy", float), ("intensity", float)],
+        shape=(R_Nx, R_Ny),
+        name="braggpeaks_raw",
+    )
+    for rx, ry in np.ndindex(R_Nx, R_Ny):
+        if (rx, ry) == (1, 2):
+            continue
+        x0, y0 = 32 + rng.uniform(-1, 1, 2)
+        n, m = rng.integers(1, 5), rng.integers(0, 3)
+        dxy = rng.uniform(8, 20, n) * np.exp(2j * np.pi * rng.random(n))
+        dxy = np.stack((dxy.real, dxy.imag), axis=1)
+        unpaired = rng.uniform(8, 28, m) * np.exp(2j * np.pi * rng.random(m))
+        qxy = np.concatenate((
+            [[x0, y0]],
+            np.array([x0, y0]) + dxy + rng.normal(0, 0.5, (n, 2)),
+            np.array([x0, y0]) - dxy + rng.normal(0, 0.5, (n, 2)),
+            np.array([x0, y0]) + np.stack((unpaired.real, unpaired.imag), axis=1),
+        ))
+        data = np.zeros(len(qxy), dtype=braggpeaks.dtype)
+        data["qx"], data["qy"] = qxy.T
+        data["intensity"] = rng.uniform(0.5, 1, len(qxy))
+        data["intensity"][0] = 10
+        braggpeaks.get_pointlist(rx, ry).add_dataarray(data)
+    return braggpeaks
+
+
+def _get_origin_from_braggpeaks_reference(braggpeaks, bvm):
+    # the original implementation of get_origin_from_braggpeaks with findcenter='CoM'
+    R_Nx, R_Ny = braggpeaks.shape
+    x0, y0 = get_CoM(bvm)
+    for step in range(2):
+        braggvectormap = np.zeros_like(bvm)
+        qx0 = np.zeros((R_Nx, R_Ny))
+        qy0 = np.zeros((R_Nx, R_Ny))
+        for Rx, Ry in np.ndindex(R_Nx, R_Ny):
+            pointlist = braggpeaks.get_pointlist(Rx, Ry)
+            if pointlist.length > 0:
+                r2 = (pointlist.data["qx"] - x0) ** 2 + (pointlist.data["qy"] - y0) ** 2
+                index = np.argmin(r2)
+                braggvectormap = add_to_2D_array_from_floats(
+                    braggvectormap,
+                    pointlist.data["qx"][index : index + 1],
+                    pointlist.data["qy"][index : index + 1],
+                    pointlist.data["intensity"][index : index + 1],
+                )
+                qx0[Rx, Ry] = pointlist.data["qx"][index]
+                qy0[Rx, Ry] = pointlist.data["qy"][index]
+        if step == 0:
+            x0, y0 = get_CoM(braggvectormap)
+    return qx0, qy0, braggvectormap
+
+
+def _get_origin_beamstop_braggpeaks_reference(braggpeaks, center_guess, radii,
+                                              max_dist=2, max_iter=1):
+    # the original implementation of get_origin_beamstop_braggpeaks
+    R_Nx, R_Ny = braggpeaks.shape
+    braggpeaks_masked = braggpeaks.copy()
+    for rx, ry in np.ndindex(R_Nx, R_Ny):
+        pl = braggpeaks_masked.get_pointlist(rx, ry)
+        qr = np.hypot(pl.data["qx"] - center_guess[0], pl.data["qy"] - center_guess[1])
+        pl.remove_points(np.logical_not(np.logical_and(qr >= radii[0], qr <= radii[1])))
+    center_curr = center_guess
+    for ii in range(max_iter):
+        centers = np.zeros((R_Nx, R_Ny, 2))
+        found_center = np.zeros((R_Nx, R_Ny), dtype=bool)
+        for rx, ry in np.ndindex(R_Nx, R_Ny):
+            pl = braggpeaks_masked.get_pointlist(rx, ry)
+            is_paired = np.zeros(len(pl.data), dtype=bool)
+            matches = []
+            for i in range(len(pl.data)):
+                if not is_paired[i]:
+                    x_r = -pl.data["qx"][i] + 2 * center_curr[0]
+                    y_r = -pl.data["qy"][i] + 2 * center_curr[1]
+                    dists = np.hypot(x_r - pl.data["qx"], y_r - pl.data["qy"])
+                    dists[is_paired] = 2 * max_dist
+                    if any(dists <= max_dist):
+                        match = np.argmin(dists)
+                        matches.append((i, match))
+                        is_paired[i], is_paired[match] = True, True
+            if len(matches) > 0:
+                x0 = [np.mean(pl.data["qx"][list(m)]) for m in matches]
+                y0 = [np.mean(pl.data["qy"][list(m)]) for m in matches]
+                centers[rx, ry, :] = np.mean(x0), np.mean(y0)
+                found_center[rx, ry] = True
+        center_curr = (
+            np.mean(centers[found_center, 0]), np.mean(centers[found_center, 1])
+        )
+    found_center = np.logical_not(np.dstack([found_center, found_center]))
+    return np.ma.array(data=centers, mask=found_center)
+
+
+class TestGaussIIR(unittest.TestCase):
+
+    def test_impulse_response(self):
+        # away from the edges, the impulse response is a unit sum, zero mean blur with
+        # standard deviation sigma, close in shape to a gaussian
+        for sigma in [1, 1.5, 3, 8]:
+            N = int(40 * sigma) + 41
+            im = np.zeros((N, N))
+            im[N // 2, N // 2] = 1
+            out = origin._gauss_iir_2d(im, sigma)
+            x = np.arange(N) - N // 2
+            self.assertAlmostEqual(out.sum(), 1, places=6)
+            for profile in (out.sum(axis=1), out.sum(axis=0)):
+                self.assertAlmostEqual(np.dot(profile, x), 0, places=6)
+                self.assertAlmostEqual(
+                    np.sqrt(np.dot(profile, x ** 2)), sigma, delta=1e-6 * sigma
+                )
+            g = gaussian_filter(im, sigma, truncate=8)
+            self.assertLess(np.abs(out - g).max(), 0.05 * g.max())
+
+    def test_float32(self):
+        im = np.random.default_rng(0).random((2, 40, 30))
+        out = origin._gauss_iir_2d(im.astype(np.float32), 3)
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_allclose(out, origin._gauss_iir_2d(im, 3), atol=1e-5)
+
+
+class TestGetOrigin(unittest.TestCase):
+
+    def setUp(self):
+        self.r = 4
+        self.datacube, self.qx0, self.qy0 = _make_datacube(r=self.r)
+
+    def test_get_origin_matches_reference(self):
+        qx0, qy0 = origin.get_origin(
+            self.datacube, r=self.r, working_dtype=np.float64
+        )
+        for rx, ry in np.ndindex(qx0.shape):
+            ans = _get_origin_single_dp_reference(self.datacube.data[rx, ry], self.r)
+            np.testing.assert_allclose((qx0[rx, ry], qy0[rx, ry]), ans, atol=1e-9)
+            np.testing.assert_allclose(
+                origin.get_origin_single_dp(
+                    self.datacube.data[rx, ry], self.r, working_dtype=np.float64
+                ),
+                ans, atol=1e-9
+            )
+
+    def test_get_origin_float32(self):
+        qx0, qy0 = origin.get_origin(self.datacube, r=self.r)
+        qx0_64, qy0_64 = origin.get_origin(
+            self.datacube, r=self.r, working_dtype=np.float64
+        )
+        np.testing.assert_allclose(qx0, qx0_64, atol=1e-3)
+        np.testing.assert_allclose(qy0, qy0_64, atol=1e-3)
+
+    def test_get_origin_tiles(self):
+        # tiles of a single pattern, and of several patterns which don't divide the row
+        qx0, qy0 = origin.get_origin(self.datacube, r=self.r)
+        tile_bytes = self.datacube.data[0, 0].astype(np.float32).nbytes
+        for n in [1, 3]:
+            with mock.patch.object(origin, "_TILE_BYTES", n * tile_bytes):
+                _qx0, _qy0 = origin.get_origin(self.datacube, r=self.r)
+            self.assertTrue(np.array_equal(qx0, _qx0))
+            self.assertTrue(np.array_equal(qy0, _qy0))
+
+    def test_get_origin_mask(self):
+        mask = np.ones((self.datacube.R_Nx, self.datacube.R_Ny), dtype=bool)
+        mask[1, 2] = False
+        mask[3, :] = False
+        qx0, qy0 = origin.get_origin(self.datacube, r=self.r, mask=mask)
+        _qx0, _qy0 = origin.get_origin(self.datacube, r=self.r)
+        self.assertTrue(np.array_equal(qx0.mask, ~mask))
+        self.assertTrue(np.array_equal(qx0[mask], _qx0[mask]))
+        self.assertTrue(np.array_equal(qy0[mask], _qy0[mask]))
+
+    def test_get_origin_max_workers(self):
+        mask = np.ones((self.datacube.R_Nx, self.datacube.R_Ny), dtype=bool)
+        mask[0, 1] = False
+        for _mask in (None, mask):
+            qx0, qy0 = origin.get_origin(self.datacube, r=self.r, mask=_mask)
+            _qx0, _qy0 = origin.get_origin(
+                self.datacube, r=self.r, mask=_mask, max_workers=2
+            )
+            self.assertTrue(np.array_equal(qx0, _qx0))
+            self.assertTrue(np.array_equal(qy0, _qy0))
+
+    def test_blank_pattern_is_nan(self):
+        self.datacube.data[1, 2] = 0
+        for module in (origin, origin_nonumba):
+            qx0, qy0 = module.get_origin_single_dp(np.zeros((32, 32)), 3)
+            self.assertTrue(np.isnan(qx0) and np.isnan(qy0))
+            qx0, qy0 = module.get_origin(self.datacube, r=self.r)
+            self.assertTrue(np.isnan(qx0[1, 2]) and np.isnan(qy0[1, 2]))
+            self.assertEqual(np.count_nonzero(np.isnan(qx0)), 1)
+
+    def test_numba_matches_numpy(self):
+        qx0, qy0 = origin.get_origin(self.datacube, r=self.r)
+        _qx0, _qy0 = origin_nonumba.get_origin(self.datacube, r=self.r)
+        np.testing.assert_allclose(qx0, _qx0, atol=1e-9)
+        np.testing.assert_allclose(qy0, _qy0, atol=1e-9)
+
+    @unittest.skipUnless(importlib.util.find_spec("cupy"), "cupy is not installed")
+    def test_get_origin_CUDA(self):
+        qx0, qy0 = origin.get_origin(self.datacube, r=self.r, CUDA=True)
+        _qx0, _qy0 = origin.get_origin(self.datacube, r=self.r)
+        np.testing.assert_allclose(qx0, _qx0, atol=1e-3)
+        np.testing.assert_allclose(qy0, _qy0, atol=1e-3)
+
+
+class TestGetOriginPhasor(unittest.TestCase):
+
+    def setUp(self):
+        self.datacube, self.qx0, self.qy0 = _make_datacube(seed=1)
+        # no background, which would pull the circular center of mass to the middle
+        self.datacube.data[self.datacube.data < 0.01] = 0
+
+    def test_get_origin_phasor(self):
+        qx0, qy0 = origin.get_origin_phasor(self.datacube)
+        np.testing.assert_allclose(qx0, self.qx0, atol=0.05)
+        np.testing.assert_allclose(qy0, self.qy0, atol=0.05)
+        for rx, ry in np.ndindex(qx0.shape):
+            np.testing.assert_allclose(
+                origin.get_origin_single_dp_phasor(self.datacube.data[rx, ry]),
+                (qx0[rx, ry], qy0[rx, ry])
+            )
+
+    def test_get_origin_phasor_wraps(self):
+        # a disk centered on the corner of the pattern
+        dp = np.roll(self.datacube.data[0, 0], (-24, -20), axis=(0, 1))
+        qx0, qy0 = origin.get_origin_single_dp_phasor(dp)
+        self.assertAlmostEqual(
+            (qx0 - (self.qx0[0, 0] - 24) + 24) % 48 - 24, 0, delta=0.05
+        )
+        self.assertAlmostEqual(
+            (qy0 - (self.qy0[0, 0] - 20) + 20) % 40 - 20, 0, delta=0.05
+        )
+
+    def test_get_origin_phasor_mask(self):
+        mask = np.ones((self.datacube.R_Nx, self.datacube.R_Ny), dtype=bool)
+        mask[2, 3] = False
+        qx0, qy0 = origin.get_origin_phasor(self.datacube, mask=mask)
+        _qx0, _qy0 = origin.get_origin_phasor(self.datacube)
+        self.assertTrue(np.array_equal(qx0.mask, ~mask))
+        self.assertTrue(np.array_equal(qx0[mask], _qx0[mask]))
+
+    def test_blank_pattern_is_nan(self):
+        self.datacube.data[1, 2] = 0
+        qx0, qy0 = origin.get_origin_single_dp_phasor(self.datacube.data[1, 2])
+        self.assertTrue(np.isnan(qx0) and np.isnan(qy0))
+        qx0, qy0 = origin.get_origin_phasor(self.datacube)
+        self.assertTrue(np.isnan(qx0[1, 2]) and np.isnan(qy0[1, 2]))
+        self.assertEqual(np.count_nonzero(np.isnan(qx0)), 1)
+
+
+class TestGetOriginBeamstop(unittest.TestCase):
+
+    def test_get_origin_beamstop(self):
+        # odd and even pattern sizes, and integer data
+        for shape in [(48, 40), (47, 39)]:
+            for dtype in [np.float64, np.uint16]:
+                datacube, mask = _make_beamstop_datacube(*shape, dtype)
+                qx0, qy0 = origin.get_origin_beamstop(datacube, mask)
+                for rx, ry in np.ndindex(qx0.shape):
+                    dp = datacube.data[rx, ry]
+                    ans = _get_origin_single_dp_beamstop_reference(dp, mask)
+                    self.assertEqual((qx0[rx, ry], qy0[rx, ry]), ans)
+                    self.assertEqual(
+                        origin.get_origin_single_dp_beamstop(dp, mask), ans
+                    )
+
+
+class TestGetOriginBrightestDisk(unittest.TestCase):
+
+    def _get_origin_brightest_disk_reference(self, datacube, probe_kernel, qxyInit,
+                                             probe_mask_size):
+        # the original implementation of get_origin_brightest_disk with subpixel=None
+        probe_kernel_FT = np.conj(np.fft.fft2(probe_kernel))
+        qx = np.arange(datacube.Q_Nx) - qxyInit[0]
+        qy = np.arange(datacube.Q_Ny) - qxyInit[1]
+        qya, qxa = np.meshgrid(qy, qx)
+        mask = np.exp((qxa ** 2 + qya ** 2) / (-2 * probe_mask_size ** 2))
+        qx0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
+        qy0 = np.zeros((datacube.R_Nx, datacube.R_Ny))
+        for rx, ry in np.ndindex(datacube.R_Nx, datacube.R_Ny):
+            dp_corr = np.real(np.fft.ifft2(
+                np.fft.fft2(datacube.data[rx, ry] * mask) * probe_kernel_FT
+            ))
+            qx0[rx, ry], qy0[rx, ry] = np.unravel_index(
+                np.argmax(dp_corr), dp_corr.shape
+            )
+        return qx0, qy0
+
+    def test_get_origin_brightest_disk(self):
+        # odd and even pattern sizes, and integer data
+        for Q_Ny in [40, 39]:
+            datacube, _, _ = _make_datacube(R_Nx=3, R_Ny=4, Q_Ny=Q_Ny, seed=2)
+            # a real probe kernel: a disk centered on the origin, minus its mean
+            qyy, qxx = np.meshgrid(
+                np.fft.fftfreq(Q_Ny, 1 / Q_Ny), np.fft.fftfreq(48, 1 / 48)
+            )
+            probe_kernel = (np.hypot(qxx, qyy) < 4).astype(float)
+            probe_kernel -= probe_kernel.mean()
+            qxyInit = (24, Q_Ny // 2)
+            for data in (datacube.data, np.round(1000 * datacube.data).astype(np.uint16)):
+                datacube = DataCube(data=data)
+                qx0, qy0 = origin.get_origin_brightest_disk(
+                    datacube, probe_kernel, qxyInit=qxyInit, probe_mask_size=8
+                )
+                ans = self._get_origin_brightest_disk_reference(
+                    datacube, probe_kernel, qxyInit, 8
+                )
+                self.assertTrue(np.array_equal(qx0, ans[0]))
+                self.assertTrue(np.array_equal(qy0, ans[1]))
+
+
+class TestBraggPeaks(unittest.TestCase):
+
+    def setUp(self):
+        self.braggpeaks = _make_braggpeaks()
+        self.Q_Nx = self.Q_Ny = 64
+
+    def test_get_origin_from_braggpeaks(self):
+        # the Bragg vector map of the uncentered peaks
+        bvm = np.zeros((self.Q_Nx, self.Q_Ny))
+        for rx, ry in np.ndindex(self.braggpeaks.shape):
+            data = self.braggpeaks.get_pointlist(rx, ry).data
+            bvm = add_to_2D_array_from_floats(
+                bvm, data["qx"], data["qy"], data["intensity"]
+            )
+        qx0, qy0, braggvectormap = origin.get_origin_from_braggpeaks(
+            self.braggpeaks, self.Q_Nx, self.Q_Ny, bvm=bvm
+        )
+        ans = _get_origin_from_braggpeaks_reference(self.braggpeaks, bvm)
+        self.assertTrue(np.array_equal(qx0, ans[0]))
+        self.assertTrue(np.array_equal(qy0, ans[1]))
+        np.testing.assert_allclose(braggvectormap, ans[2], atol=1e-12)
+        # the central peak is found everywhere but at the empty position
+        self.assertEqual(qx0[1, 2], 0)
+        self.assertTrue(np.all(np.abs(qx0[qx0 != 0] - 32) < 1))
+
+    def test_get_origin_beamstop_braggpeaks(self):
+        for module in (origin, origin_nonumba):
+            for max_iter in [1, 2]:
+                ans = _get_origin_beamstop_braggpeaks_reference(
+                    self.braggpeaks, (32, 32), (5, 25), max_iter=max_iter
+                )
+                origins = module.get_origin_beamstop_braggpeaks(
+                    self.braggpeaks, (32, 32), (5, 25), self.Q_Nx, self.Q_Ny,
+                    max_iter=max_iter
+                )
+                self.assertTrue(np.array_equal(origins.mask, ans.mask))
+                np.testing.assert_allclose(origins[~origins.mask], ans[~ans.mask])
+                self.assertTrue(origins.mask[1, 2].all())
+
+    def test_center_braggpeaks(self):
+        rng = np.random.default_rng(1)
+        qx0, qy0 = rng.uniform(30, 34, (2,) + self.braggpeaks.shape)
+        for _qx0, _qy0 in [(32.5, 31.5), (qx0, qy0)]:
+            centered = origin.center_braggpeaks(self.braggpeaks, qx0=_qx0, qy0=_qy0)
+            self.assertEqual(centered.name, "braggpeaks_centered")
+            self.assertEqual(centered.shape, self.braggpeaks.shape)
+            for rx, ry in np.ndindex(self.braggpeaks.shape):
+                ans = self.braggpeaks.get_pointlist(rx, ry).data.copy()
+                ans["qx"] -= _qx0 if np.isscalar(_qx0) else _qx0[rx, ry]
+                ans["qy"] -= _qy0 if np.isscalar(_qy0) else _qy0[rx, ry]
+                pointlist = centered.get_pointlist(rx, ry)
+                self.assertEqual(pointlist.length, len(ans))
+                self.assertTrue(np.array_equal(pointlist.data, ans))
+
+
+class TestFindOutlierShifts(unittest.TestCase):
+
+    def _score_reference(self, xshifts, yshifts):
+        Nx, Ny = xshifts.shape
+        score = np.zeros((Nx, Ny))
+        for i, j in np.ndindex(Nx, Ny):
+            diffs = [
+                abs(xshifts[i, j] - xshifts[ii, jj]) + abs(yshifts[i, j] - yshifts[ii, jj])
+                for ii in range(i - 1, i + 2) for jj in range(j - 1, j + 2)
+                if (ii, jj) != (i, j) and 0 <= ii < Nx and 0 <= jj < Ny
+            ]
+            if diffs:
+                score[i, j] = np.mean(diffs)
+        return score
+
+    def test_score(self):
+        rng = np.random.default_rng(0)
+        for shape in [(1, 1), (1, 6), (6, 1), (7, 9)]:
+            for dtype in [float, int]:
+                xshifts = (10 * rng.random(shape)).astype(dtype)
+                yshifts = (10 * rng.random(shape)).astype(dtype)
+                ans = self._score_reference(xshifts, yshifts)
+                for module in (origin, origin_nonumba):
+                    mask, score, cutoff = module.find_outlier_shifts(
+                        xshifts, yshifts, n_sigma=1
+                    )
+                    np.testing.assert_allclose(score, ans)
+                    self.assertTrue(np.array_equal(mask, ans > np.std(ans)))
+
+    def test_same_shifts(self):
+        # passing the same array for both shifts
+        shifts = 10 * np.random.default_rng(0).random((5, 6))
+        ans = self._score_reference(shifts, shifts.copy())
+        for module in (origin, origin_nonumba):
+            mask, score, cutoff = module.find_outlier_shifts(shifts, shifts)
+            np.testing.assert_allclose(score, ans)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# Tests for process utility functions
+
+import unittest
+import numpy as np
+
+from py4DSTEM.process.utils import bin2D, add_to_2D_array_from_floats
+
+
+class TestBin2D(unittest.TestCase):
+
+    def setUp(self):
+        self.array = np.random.default_rng(0).random((13, 10))
+
+    def _bin2D_reference(self, array, factor):
+        x, y = array.shape[0] // factor, array.shape[1] // factor
+        return array[:x * factor, :y * factor].reshape(x, factor, y, factor).sum(axis=(1, 3))
+
+    def test_bin2D(self):
+        for factor in [1, 2, 3, 4]:
+            np.testing.assert_allclose(
+                bin2D(self.array, factor), self._bin2D_reference(self.array, factor)
+            )
+
+    def test_bin2D_out(self):
+        out = np.full((4, 3), np.nan, dtype=np.float32)
+        binned = bin2D(self.array, 3, dtype=np.float32, out=out)
+        self.assertIs(binned, out)
+        np.testing.assert_allclose(
+            out, self._bin2D_reference(self.array, 3), rtol=1e-6
+        )
+        # out is overwritten, not accumulated into
+        bin2D(self.array, 3, dtype=np.float32, out=out)
+        np.testing.assert_allclose(
+            out, self._bin2D_reference(self.array, 3), rtol=1e-6
+        )
+
+    def test_bin2D_out_shape(self):
+        with self.assertRaises(AssertionError):
+            bin2D(self.array, 3, out=np.zeros((4, 4)))
+
+
+class TestAddTo2DArrayFromFloats(unittest.TestCase):
+
+    def test_repeated_pixels(self):
+        ar = np.zeros((6, 6))
+        x = np.array([1.0, 1.0, 2.5])
+        y = np.array([2.0, 2.0, 3.5])
+        I = np.array([1.0, 2.0, 4.0])
+        ar = add_to_2D_array_from_floats(ar, x, y, I)
+        self.assertAlmostEqual(ar[1, 2], 3)
+        self.assertAlmostEqual(ar.sum(), 7)
+        np.testing.assert_allclose(ar[2:4, 3:5], np.ones((2, 2)))
+
+    def test_matches_single_points(self):
+        # adding many points at once is the same as adding them one at a time, and
+        # points whose neighborhood isn't entirely in the array are dropped
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-1, 9, 200), rng.uniform(-1, 7, 200)
+        I = rng.random(200)
+        ans = np.zeros((8, 6))
+        for i in range(200):
+            ans = add_to_2D_array_from_floats(ans, x[i:i + 1], y[i:i + 1], I[i:i + 1])
+        ar = add_to_2D_array_from_floats(np.zeros((8, 6)), x, y, I)
+        np.testing.assert_allclose(ar, ans)
+
+    def test_scalars(self):
+        ar = add_to_2D_array_from_floats(np.zeros((4, 4)), 1.5, 2.25, 2.0)
+        np.testing.assert_allclose(ar[1:3, 2:4], [[0.75, 0.25], [0.75, 0.25]])
+        self.assertAlmostEqual(ar.sum(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()